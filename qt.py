@@ -2,12 +2,16 @@
 from __future__ import annotations
 
 import os
+import re
 import sys
 import sqlite3
 import time
 import csv
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Tuple, Optional, Callable, Dict
+from functools import partial
+from typing import List, Tuple, Optional, Callable, Dict, Iterator
 
 BANNER = "Query Terminal (SQLite). Type .help"
 HELP = """\
@@ -26,44 +30,106 @@ SQL:
 
 HISTFILE = os.path.expanduser("~/.qt_history")
 HISTLEN = 2000
-
-
-def _format_table(headers: List[str], rows: List[Tuple]) -> str:
-    if not headers:
-        return "(no columns)"
-
-    clean_rows = []
-    for r in rows:
-        clean_rows.append([str("" if v is None else v).replace("\n", "\\n") for v in r])
-
-    widths = [len(h) for h in headers]
-    for r in clean_rows:
-        for i, v in enumerate(r):
-            if i < len(widths):
-                widths[i] = max(widths[i], len(v))
-
-    def fmt_row(row_data: List[str]) -> str:
-        return " | ".join(v.ljust(widths[i]) for i, v in enumerate(row_data))
-
-    sep = "-+-".join("-" * w for w in widths)
-    out = [fmt_row(headers), sep]
-    out.extend(fmt_row(r) for r in clean_rows)
-    return "\n".join(out)
-
-
-def _print_table(headers: List[str], rows: List[Tuple]) -> None:
+HIST_FLUSH_EVERY = 16
+PAGE_SIZE = 1000
+DUMP_CHUNK = 64 * 1024
+COLS_CACHE_SIZE = 128
+FILE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+)
+SQL_LIST_TABLES = "SELECT name FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%' ORDER BY 1"
+SQL_LIST_COLUMNS = "SELECT name FROM pragma_table_info(?)"
+SQL_ALL_COLUMNS = (
+    "SELECT p.name FROM sqlite_master m, pragma_table_info(m.name) p "
+    "WHERE m.type IN ('table','view') AND m.name NOT LIKE 'sqlite_%'"
+)
+SQL_SCHEMA = "SELECT sql FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%'"
+
+DDL_RE = re.compile(r"^\s*(CREATE|DROP|ALTER)\b", re.ASCII | re.IGNORECASE | re.MULTILINE)
+BATCH_VERBS = frozenset({"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER"})
+KEYWORDS = tuple(sorted(("SELECT", "FROM", "WHERE", "INSERT", "UPDATE", "DELETE", "CREATE", "TABLE", "JOIN")))
+
+
+def _clean_row(row: Tuple) -> List[str]:
+    return [str("" if v is None else v).replace("\n", "\\n") for v in row]
+
+
+def _iter_format_rows(headers: List[str], cur: sqlite3.Cursor, page: int = PAGE_SIZE) -> Iterator[str]:
+    fetch = cur.fetchmany
+    clean = _clean_row
+    chunk = [clean(r) for r in fetch(page)]
+
+    if chunk:
+        widths = [max(len(h), *map(len, col)) for h, col in zip(headers, zip(*chunk))]
+    else:
+        widths = [len(h) for h in headers]
+
+    fmt_row = (" | ".join(f"{{:<{w}}}" for w in widths) + "\n").format
+
+    yield fmt_row(*headers)
+    yield "-+-".join("-" * w for w in widths) + "\n"
+    while chunk:
+        for r in chunk:
+            yield fmt_row(*r)
+        chunk = [clean(r) for r in fetch(page)]
+
+
+def _print_table(headers: List[str], cur: sqlite3.Cursor) -> None:
     if not headers:
         print("(no columns)")
         return
-    print(_format_table(headers, rows))
-    if not rows:
-        print("(empty)")
+    write = sys.stdout.write
+    buf: List[str] = []
+    append = buf.append
+    n = 0
+    for n, line in enumerate(_iter_format_rows(headers, cur), 1):
+        append(line)
+        if len(buf) >= PAGE_SIZE:
+            write("".join(buf))
+            buf.clear()
+    if n <= 2:
+        append("(empty)\n")
+    write("".join(buf))
+    sys.stdout.flush()
+
+
+def _write_fd(fd: int, data: bytearray) -> None:
+    while data:
+        del data[:os.write(fd, data)]
+
+
+def _is_batch_stmt(stmt: str) -> bool:
+    verb = stmt.split(None, 1)[0].upper()
+    return verb in BATCH_VERBS and "RETURNING" not in stmt.upper()
+
+
+def _split_statements(sql: str) -> List[str]:
+    parts = sql.split(";")
+    stmts: List[str] = []
+    buf = ""
+    for part in parts[:-1]:
+        buf += part + ";"
+        if sqlite3.complete_statement(buf):
+            if buf.strip(" \t\r\n;"):
+                stmts.append(buf.strip())
+            buf = ""
+    tail = (buf + parts[-1]).strip()
+    if tail and stmts:
+        stmts[-1] += "\n" + tail
+    elif tail:
+        stmts.append(tail)
+    return stmts
 
 
 @dataclass
 class Runtime:
     conn: sqlite3.Connection
     path: str
+    prompt: str
 
 
 class QT:
@@ -79,22 +145,34 @@ class QT:
             ".dump": self._m_dump,
             ".import": self._m_import,
         }
+        self._meta_sorted = tuple(sorted(self._meta))
         self._timer = False
         self._readline = None
+        self._unsaved = 0
+        self._hist_batch = HIST_FLUSH_EVERY
+        self._last_complete: Tuple[Tuple[str, str], List[str]] = (("", ""), [])
 
     def _prompt(self) -> str:
-        name = os.path.basename(self.rt.path)
-        return f"{name}$ " if not self._buffer else "... "
+        return self.rt.prompt if not self._buffer else "... "
 
     def _read_line(self) -> Optional[str]:
         try:
-            return input(self._prompt()).strip()
+            if self._readline is not None:
+                return input(self._prompt()).strip()
+            sys.stdout.write(self._prompt())
+            sys.stdout.flush()
+            line = sys.stdin.readline()
+            if not line:
+                raise EOFError
+            return line.strip()
         except (EOFError, KeyboardInterrupt):
             print()
             self._m_exit([])
             return None
 
     def _setup_readline(self) -> None:
+        if not sys.stdin.isatty():
+            return
         try:
             import readline
         except ImportError:
@@ -109,6 +187,10 @@ class QT:
         except FileNotFoundError:
             pass
         readline.set_history_length(HISTLEN)
+        if hasattr(readline, "set_auto_history"):
+            readline.set_auto_history(False)
+        if hasattr(readline, "append_history_file"):
+            self._hist_batch = 1
         try:
             delims = readline.get_completer_delims()
             for ch in "._":
@@ -117,50 +199,125 @@ class QT:
         except Exception:
             pass
         readline.set_completer(self._completer_func)
+        is_libedit = "libedit" in (readline.__doc__ or "")
         try:
-            if 'libedit' in readline.__doc__:
+            if is_libedit:
                 readline.parse_and_bind("bind ^I rl_complete")
             else:
                 readline.parse_and_bind("tab: complete")
         except Exception:
             pass
 
+    def _add_history(self, entry: str) -> None:
+        if not self._readline:
+            return
+        self._readline.add_history(entry)
+        self._unsaved += 1
+        if self._unsaved >= self._hist_batch:
+            self._save_history()
+
     def _save_history(self) -> None:
-        if self._readline:
+        if self._readline and self._unsaved:
             try:
-                self._readline.write_history_file(HISTFILE)
+                if hasattr(self._readline, "append_history_file") and os.path.exists(HISTFILE):
+                    self._readline.append_history_file(self._unsaved, HISTFILE)
+                else:
+                    self._readline.write_history_file(HISTFILE)
+                self._unsaved = 0
             except Exception:
                 pass
 
+    def _reset_schema_cache(self) -> None:
+        self._schema_ver: Optional[int] = None
+        self._tables_cache: Optional[List[str]] = None
+        self._all_cols_cache: Optional[List[str]] = None
+        self._cols_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._pool_cache: Optional[Tuple[List[str], List[str]]] = None
+
+    def _check_schema(self) -> None:
+        try:
+            ver = self.rt.conn.execute("PRAGMA schema_version").fetchone()[0]
+        except sqlite3.Error:
+            ver = None
+        if ver is None or ver != self._schema_ver:
+            self._reset_schema_cache()
+            self._schema_ver = ver
+
     def _list_tables(self) -> List[str]:
+        self._check_schema()
+        if self._tables_cache is None:
+            try:
+                self._tables_cache = [r[0] for r in self.rt.conn.execute(SQL_LIST_TABLES)]
+            except:
+                return []
+        return self._tables_cache
+
+    def _list_columns(self, table: str) -> List[str]:
+        self._check_schema()
+        cache = self._cols_cache
+        cols = cache.get(table)
+        if cols is not None:
+            cache.move_to_end(table)
+            return cols
         try:
-            q = "SELECT name FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%'"
-            return [r[0] for r in self.rt.conn.execute(q)]
-        except:
+            cols = cache[table] = [r[0] for r in self.rt.conn.execute(SQL_LIST_COLUMNS, (table,))]
+        except sqlite3.Error:
             return []
+        if len(cache) > COLS_CACHE_SIZE:
+            cache.popitem(last=False)
+        return cols
+
+    def _all_columns(self) -> List[str]:
+        self._check_schema()
+        if self._all_cols_cache is None:
+            try:
+                rows = self.rt.conn.execute(SQL_ALL_COLUMNS)
+                self._all_cols_cache = list(dict.fromkeys(r[0] for r in rows))
+            except sqlite3.Error:
+                cols: Dict[str, None] = {}
+                for t in self._list_tables():
+                    cols.update(dict.fromkeys(self._list_columns(t)))
+                self._all_cols_cache = list(cols)
+        return self._all_cols_cache
+
+    def _completion_pool(self) -> Tuple[List[str], List[str]]:
+        self._check_schema()
+        if self._pool_cache is None:
+            words = sorted(set(KEYWORDS).union(self._list_tables(), self._all_columns()), key=lambda w: (w.upper(), w))
+            self._pool_cache = ([w.upper() for w in words], words)
+        return self._pool_cache
 
     def _completer_func(self, text: str, state: int) -> Optional[str]:
         if not self._readline:
             return None
         buffer = self._readline.get_line_buffer()
+        key = (buffer, text)
+        if state == 0 or self._last_complete[0] != key:
+            self._last_complete = (key, self._complete_options(buffer, text))
+        options = self._last_complete[1]
+        return options[state] if state < len(options) else None
 
+    def _complete_options(self, buffer: str, text: str) -> List[str]:
         if buffer.lstrip().startswith("."):
-            options = [c for c in self._meta.keys() if c.startswith(text)]
+            options = [c for c in self._meta_sorted if c.startswith(text)]
+        elif "." in text:
+            table, _, prefix = text.partition(".")
+            prefix_u = prefix.upper()
+            options = [f"{table}.{c}" for c in self._list_columns(table) if c.upper().startswith(prefix_u)]
         else:
-            keywords = ["SELECT", "FROM", "WHERE", "INSERT", "UPDATE", "DELETE", "Create", "TABLE", "JOIN"]
-            tables = self._list_tables()
-            pool = keywords + tables
-            options = [w for w in pool if w.upper().startswith(text.upper())]
-
-        options = sorted(list(set(options)))
-        return options[state] if state < len(options) else None
+            upper, words = self._completion_pool()
+            text_u = text.upper()
+            lo = bisect_left(upper, text_u)
+            hi = bisect_right(upper, text_u + "\uffff", lo)
+            options = words[lo:hi]
+        return options
 
     def _m_help(self, _: List[str]) -> None:
         print(HELP)
 
     def _m_exit(self, _: List[str]) -> None:
         self._save_history()
-        self.rt.conn.close()
+        self._close()
         print("Bye.")
         sys.exit(0)
 
@@ -168,7 +325,7 @@ class QT:
         if not args:
             print("Usage: .open <path>")
             return
-        self.rt.conn.close()
+        self._close()
         self.rt = self._open(args[0])
         print(f"Opened {self.rt.path}")
 
@@ -179,30 +336,53 @@ class QT:
                 print(" ".join(names) if names else "(no tables)")
                 return
             name = args[0]
-            quoted = f'"{name}"'
+            quoted = '"' + name.replace('"', '""') + '"'
             cur = self.rt.conn.execute(f"SELECT * FROM {quoted}")
             headers = [d[0] for d in cur.description]
-            rows = cur.fetchall()
-            _print_table(headers, rows)
+            _print_table(headers, cur)
         except sqlite3.Error as e:
             print(f"SQL error: {e}")
 
     def _m_schema(self, args: List[str]) -> None:
-        q = "SELECT sql FROM sqlite_master WHERE type IN ('table','view') AND name NOT LIKE 'sqlite_%'"
+        q = SQL_SCHEMA
+        params: Tuple = ()
         if args:
-            q += f" AND name = '{args[0]}'"
+            q += " AND name = ?"
+            params = (args[0],)
         try:
-            rows = self.rt.conn.execute(q).fetchall()
-            for (sql,) in rows:
-                if sql:
-                    print(sql.strip() + ";\n")
+            cur = self.rt.conn.execute(q, params)
+            sys.stdout.write("".join(sql.strip() + ";\n\n" for (sql,) in cur if sql))
         except sqlite3.Error as e:
             print(e)
 
     def _m_dump(self, _: List[str]) -> None:
+        out = getattr(sys.stdout, "buffer", None)
+        encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+        errors = getattr(sys.stdout, "errors", None) or "strict"
+        try:
+            fd: Optional[int] = None if sys.stdout.isatty() else sys.stdout.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
         try:
+            if out is None and fd is None:
+                sys.stdout.writelines(line + "\n" for line in self.rt.conn.iterdump())
+                return
+            sys.stdout.flush()
+            if fd is None:
+                write = out.write
+            else:
+                write = partial(_write_fd, fd)
+            buf = bytearray()
             for line in self.rt.conn.iterdump():
-                print(line)
+                buf += line.encode(encoding, errors)
+                buf += b"\n"
+                if len(buf) >= DUMP_CHUNK:
+                    write(buf)
+                    buf.clear()
+            if buf:
+                write(buf)
+            if fd is None:
+                out.flush()
         except sqlite3.Error as e:
             print(f"SQL error: {e}")
 
@@ -227,78 +407,143 @@ class QT:
                 safe_headers = [h.strip().replace(" ", "_") for h in headers]
                 cols_def = ", ".join([f'"{col}" TEXT' for col in safe_headers])
 
-                self.rt.conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({cols_def})")
-
-                placeholders = ", ".join(["?"] * len(safe_headers))
+                n = len(safe_headers)
+                placeholders = ", ".join(["?"] * n)
                 query = f"INSERT INTO {table_name} VALUES ({placeholders})"
 
-                self.rt.conn.executemany(query, reader)
-                self.rt.conn.commit()
+                conn = self.rt.conn
+                own_tx = not conn.in_transaction
+                if own_tx:
+                    sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+                    conn.execute("PRAGMA synchronous=OFF")
+                try:
+                    if own_tx:
+                        conn.execute("BEGIN")
+                    conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({cols_def})")
+                    conn.executemany(query, ((row + [""] * n)[:n] for row in reader))
+                    if own_tx:
+                        conn.execute("COMMIT")
+                except BaseException:
+                    if own_tx and conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    if own_tx:
+                        conn.execute(f"PRAGMA synchronous={int(sync)}")
                 print(f"Success: Imported data into '{table_name}'.")
         except Exception as e:
             print(f"Import failed: {e}")
 
     def _exec_sql(self, sql: str) -> None:
+        stmts = _split_statements(sql)
+        if len(stmts) > 1 and not self.rt.conn.in_transaction and all(map(_is_batch_stmt, stmts)):
+            if self._exec_script(stmts):
+                return
+        for stmt in stmts:
+            if not self._exec_statement(stmt):
+                break
+
+    def _exec_script(self, stmts: List[str]) -> bool:
+        conn = self.rt.conn
         start = time.perf_counter()
         try:
-            cur = self.rt.conn.execute(sql)
+            conn.executescript("SAVEPOINT qt_batch;\n" + "\n".join(stmts) + "\nRELEASE qt_batch;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return False
+        if any(DDL_RE.match(stmt) for stmt in stmts):
+            self._schema_ver = None
+        sys.stdout.write("OK\n" * len(stmts))
+        if self._timer:
+            ms = (time.perf_counter() - start) * 1000
+            print(f"(Time: {ms:.2f} ms)")
+        return True
+
+    def _exec_statement(self, sql: str) -> bool:
+        conn = self.rt.conn
+        start = time.perf_counter()
+        try:
+            cur = conn.execute(sql)
             if cur.description:
                 headers = [d[0] for d in cur.description]
-                rows = cur.fetchall()
-                _print_table(headers, rows)
+                _print_table(headers, cur)
             else:
+                if DDL_RE.search(sql):
+                    self._schema_ver = None
                 print("OK")
+            return True
         except sqlite3.Error as e:
             try:
-                self.rt.conn.rollback()
+                conn.rollback()
             except sqlite3.Error:
                 pass
             print(f"SQL error: {e}")
+            return False
         finally:
             if self._timer:
                 ms = (time.perf_counter() - start) * 1000
                 print(f"(Time: {ms:.2f} ms)")
 
     def _open(self, path: str) -> Runtime:
-        if path != ":memory:":
+        uri = path.startswith("file:")
+        in_memory = path == ":memory:" or (uri and (path.startswith("file::memory:") or "mode=memory" in path))
+        if not uri and not in_memory and not os.path.exists(path):
             d = os.path.dirname(os.path.abspath(path))
-            if d and not os.path.exists(d):
+            if d and not os.path.isdir(d):
                 os.makedirs(d, exist_ok=True)
-        conn = sqlite3.connect(path)
-        conn.isolation_level = None
-        return Runtime(conn=conn, path=path)
+        conn = sqlite3.connect(path, isolation_level=None, cached_statements=512, check_same_thread=False, uri=uri)
+        if not in_memory:
+            for pragma in FILE_PRAGMAS:
+                try:
+                    conn.execute(pragma)
+                except sqlite3.Error:
+                    pass
+        self._reset_schema_cache()
+        name = os.path.basename(path) or path
+        return Runtime(conn=conn, path=path, prompt=f"{name}$ ")
+
+    def _handle_meta(self, line: str) -> None:
+        cmd, *rest = line.split(None, 1)
+        fn = self._meta.get(cmd.lower())
+        if fn is None:
+            print(f"Unknown command: {cmd}")
+            return
+        fn(rest[0].split() if rest else [])
+
+    def _close(self) -> None:
+        try:
+            self.rt.conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
+        self.rt.conn.close()
 
     def run(self) -> None:
         self._setup_readline()
         print(BANNER)
-        while True:
-            line = self._read_line()
-            if line is None:
-                break
-            if not line:
-                continue
-
-            if not self._buffer and line.startswith("."):
-                parts = line.split()
-                cmd = parts[0]
-                if cmd in self._meta:
-                    self._meta[cmd](parts[1:])
-                else:
-                    print(f"Unknown command: {cmd}")
-
-                if self._readline:
-                    self._readline.add_history(line)
-                self._save_history()
-                continue
-
-            self._buffer.append(line)
-            if line.endswith(";"):
+        try:
+            while True:
+                line = self._read_line()
+                if line is None:
+                    break
+                if not line:
+                    continue
+
+                if not self._buffer and line.startswith("."):
+                    self._handle_meta(line)
+                    self._add_history(line)
+                    continue
+
+                self._buffer.append(line)
+                if ";" not in line:
+                    continue
                 sql = "\n".join(self._buffer).strip()
-                self._buffer.clear()
-                self._exec_sql(sql)
-                if self._readline:
-                    self._readline.add_history(sql.replace("\n", " "))
-                self._save_history()
+                if sqlite3.complete_statement(sql):
+                    self._buffer.clear()
+                    self._exec_sql(sql)
+                    self._add_history(sql.replace("\n", " "))
+        finally:
+            self._save_history()
 # @brief
 def main() -> None:
     path = sys.argv[1] if len(sys.argv) > 1 else ":memory:"
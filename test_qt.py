@@ -1,4 +1,52 @@
-from qt import QT
+import io
+import sys
+
+import pytest
+
+import qt as qt_mod
+from qt import QT, _iter_format_rows
+
+
+class _FakeReadline:
+    def __init__(self, line=""):
+        self.line = line
+        self.history = []
+        self.writes = 0
+
+    def get_line_buffer(self):
+        return self.line
+
+    def add_history(self, line):
+        self.history.append(line)
+
+    def write_history_file(self, path):
+        self.writes += 1
+
+    def read_history_file(self, path):
+        pass
+
+    def set_history_length(self, length):
+        pass
+
+    def set_auto_history(self, enabled):
+        self.auto_history = enabled
+
+    def set_completer(self, func):
+        self.completer = func
+
+    def parse_and_bind(self, binding):
+        pass
+
+
+def _complete_all(qt, line, text):
+    qt._readline = _FakeReadline(line)
+    out = []
+    while True:
+        opt = qt._completer_func(text, len(out))
+        if opt is None:
+            return out
+        out.append(opt)
+
 
 def test_exec_sql_basic_flow(capsys):
     qt = QT(":memory:")
@@ -63,4 +111,311 @@ def test_exec_sql_with_null_and_types(capsys):
     assert "3.14" in out
     assert "(empty)" not in out
     # NULL-поля отображаются как пустые
-    assert "2" in out  # вторая строка присутствует
\ No newline at end of file
+    assert "2" in out  # вторая строка присутствует
+
+def test_list_tables_cache_invalidated_on_schema_change():
+    qt = QT(":memory:")
+    assert qt._list_tables() == []
+    qt._exec_sql("CREATE TABLE a(x);")
+    assert qt._list_tables() == ["a"]
+    # изменение схемы в обход _exec_sql тоже должно сбросить кэш
+    qt.rt.conn.execute("CREATE TABLE b(y)")
+    assert sorted(qt._list_tables()) == ["a", "b"]
+
+
+def test_all_columns_deduplicated():
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE a(id INTEGER, name TEXT);")
+    qt._exec_sql("CREATE TABLE b(id INTEGER, price REAL);")
+    assert qt._all_columns() == ["id", "name", "price"]
+
+
+def test_iter_format_rows_streams_all_pages():
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE n(v INTEGER);")
+    qt.rt.conn.executemany("INSERT INTO n VALUES (?)", [(i,) for i in range(5)])
+    cur = qt.rt.conn.execute("SELECT v FROM n ORDER BY v")
+    lines = list(_iter_format_rows(["v"], cur, page=2))
+    # заголовок + разделитель + все строки со всех страниц
+    assert len(lines) == 7
+    assert lines[-1].strip() == "4"
+
+
+def test_schema_and_dump_output(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE t(id INTEGER);")
+    qt._exec_sql("INSERT INTO t VALUES (7);")
+    capsys.readouterr()
+
+    qt._m_schema([])
+    assert capsys.readouterr().out == "CREATE TABLE t(id INTEGER);\n\n"
+
+    qt._m_dump([])
+    out = capsys.readouterr().out
+    assert "INSERT INTO \"t\" VALUES(7);" in out
+    assert out.endswith("COMMIT;\n")
+
+
+def test_completer_keywords_tables_and_meta():
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE sales(id INTEGER, seller TEXT);")
+    assert _complete_all(qt, "s", "s") == ["sales", "SELECT", "seller"]
+    assert _complete_all(qt, ".t", ".t") == [".tables"]
+
+
+def test_completer_dotted_columns():
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE users(id INTEGER, name TEXT, nick TEXT);")
+    assert _complete_all(qt, "SELECT users.n", "users.n") == ["users.name", "users.nick"]
+
+
+def test_tables_unknown_name(capsys):
+    qt = QT(":memory:")
+    qt._m_tables(['x"; DROP TABLE y; --'])
+    assert "no such table" in capsys.readouterr().out
+
+
+def test_open_file_uses_wal(tmp_path):
+    qt = QT(str(tmp_path / "sub" / "t.db"))
+    assert qt.rt.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert qt.rt.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert qt.rt.conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+
+
+def test_read_line_without_readline(monkeypatch, capsys):
+    qt = QT(":memory:")
+    monkeypatch.setattr("sys.stdin", io.StringIO("  SELECT 1;  \n"))
+    assert qt._read_line() == "SELECT 1;"
+    assert capsys.readouterr().out == ":memory:$ "
+
+
+def test_history_saved_in_batches(monkeypatch, tmp_path):
+    monkeypatch.setattr(qt_mod, "HISTFILE", str(tmp_path / "hist"))
+    qt = QT(":memory:")
+    rl = qt._readline = _FakeReadline()
+    for _ in range(qt_mod.HIST_FLUSH_EVERY - 1):
+        qt._add_history("SELECT 1;")
+    assert rl.writes == 0
+    qt._add_history("SELECT 1;")
+    assert rl.writes == 1 and qt._unsaved == 0
+    assert len(rl.history) == qt_mod.HIST_FLUSH_EVERY
+
+
+def test_completer_reuses_candidates_between_states(monkeypatch):
+    qt = QT(":memory:")
+    qt._readline = _FakeReadline("S")
+    assert qt._completer_func("S", 0) == "SELECT"
+    monkeypatch.setattr(qt, "_complete_options", lambda *a: pytest.fail("recomputed"))
+    assert qt._completer_func("S", 1) is None
+
+
+def test_handle_meta_dispatch(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE t(id INTEGER);")
+    capsys.readouterr()
+    qt._handle_meta(".TABLES")
+    assert capsys.readouterr().out == "t\n"
+    qt._handle_meta(".schema\tt")
+    assert capsys.readouterr().out == "CREATE TABLE t(id INTEGER);\n\n"
+    qt._handle_meta(".nope arg")
+    assert "Unknown command: .nope" in capsys.readouterr().out
+
+
+def test_exec_sql_multiple_statements(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE t(s TEXT); INSERT INTO t VALUES ('a;b'); SELECT s FROM t; -- конец")
+    out = capsys.readouterr().out
+    assert out.count("OK") == 2
+    assert "a;b" in out
+
+
+def test_exec_sql_stops_after_error(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE t(x); INSER INTO t VALUES (1); CREATE TABLE u(y);")
+    assert "SQL error" in capsys.readouterr().out
+    assert qt._list_tables() == ["t"]
+
+
+def test_list_columns_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(qt_mod, "COLS_CACHE_SIZE", 2)
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE a(x); CREATE TABLE b(y); CREATE TABLE c(z);")
+    assert qt._list_columns("a") == ["x"]
+    qt._list_columns("b")
+    qt._list_columns("a")
+    qt._list_columns("c")
+    # "b" использовалась реже всех и должна быть вытеснена
+    assert list(qt._cols_cache) == ["a", "c"]
+
+
+def test_open_memory_uri(capsys):
+    qt = QT("file::memory:?cache=shared")
+    qt._exec_sql("CREATE TABLE t(x);")
+    assert qt._list_tables() == ["t"]
+    assert qt.rt.conn.execute("PRAGMA journal_mode").fetchone()[0] == "memory"
+
+
+def test_dump_to_real_fd(capfd):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE t(s TEXT);")
+    qt.rt.conn.executemany("INSERT INTO t VALUES (?)", [("строка %d" % i,) for i in range(5000)])
+    capfd.readouterr()
+    qt._m_dump([])
+    out = capfd.readouterr().out
+    assert out.count("INSERT INTO") == 5000
+    assert "строка 4999" in out and out.endswith("COMMIT;\n")
+
+
+def test_import_csv_ragged_rows(tmp_path, capsys):
+    csv_path = tmp_path / "data.csv"
+    csv_path.write_text("id,full name\n1,Alice\n2\n3,Carol,extra\n", encoding="utf-8")
+    qt = QT(str(tmp_path / "t.db"))
+    qt._m_import([str(csv_path), "people"])
+    assert "Success" in capsys.readouterr().out
+    rows = qt.rt.conn.execute("SELECT id, full_name FROM people ORDER BY id").fetchall()
+    assert rows == [("1", "Alice"), ("2", ""), ("3", "Carol")]
+    assert qt.rt.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert not qt.rt.conn.in_transaction
+
+
+def test_open_runs_optimize_before_close(tmp_path, capsys):
+    qt = QT(":memory:")
+    old = qt.rt.conn
+    statements = []
+    old.set_trace_callback(statements.append)
+    qt._m_open([str(tmp_path / "other.db")])
+    assert statements[-1] == "PRAGMA optimize"
+    assert qt.rt.conn is not old
+
+
+def test_exec_sql_dml_batch_as_script(capsys):
+    qt = QT(":memory:")
+    statements = []
+    qt.rt.conn.set_trace_callback(statements.append)
+    qt._exec_sql("CREATE TABLE t(x); INSERT INTO t VALUES (1); INSERT INTO t VALUES (2);")
+    qt.rt.conn.set_trace_callback(None)
+    assert capsys.readouterr().out == "OK\n" * 3
+    # весь пакет выполнен одним executescript, без отдельных execute на каждый оператор
+    assert [s.strip() for s in statements] == [
+        "SAVEPOINT qt_batch;",
+        "CREATE TABLE t(x);",
+        "INSERT INTO t VALUES (1);",
+        "INSERT INTO t VALUES (2);",
+        "RELEASE qt_batch;",
+    ]
+    assert qt.rt.conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+    assert qt._list_tables() == ["t"]
+
+    # внутри открытой транзакции executescript не используется (он бы сделал COMMIT)
+    qt._exec_sql("BEGIN;")
+    qt._exec_sql("INSERT INTO t VALUES (3); INSERT INTO t VALUES (4);")
+    qt._exec_sql("ROLLBACK;")
+    assert qt.rt.conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+
+
+def test_completion_pool_refreshed_on_schema_change():
+    qt = QT(":memory:")
+    assert _complete_all(qt, "ord", "ord") == []
+    qt._exec_sql("CREATE TABLE orders(id INTEGER, ordered_at TEXT);")
+    assert _complete_all(qt, "ord", "ord") == ["ordered_at", "orders"]
+    assert "WHERE" in _complete_all(qt, "", "")
+
+
+def test_schema_name_is_bound(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE a(x); CREATE TABLE b(y);")
+    capsys.readouterr()
+    qt._m_schema(["b"])
+    assert capsys.readouterr().out == "CREATE TABLE b(y);\n\n"
+    qt._m_schema(["x' OR '1'='1"])
+    assert capsys.readouterr().out == ""
+
+
+def test_setup_readline_skipped_for_piped_stdin(monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO(""))
+    qt = QT(":memory:")
+    qt._setup_readline()
+    assert qt._readline is None
+
+
+def test_import_csv_inside_open_transaction(tmp_path, capsys):
+    csv_path = tmp_path / "c.csv"
+    csv_path.write_text("a\n1\n2\n", encoding="utf-8")
+    qt = QT(str(tmp_path / "t.db"))
+    qt._exec_sql("BEGIN;")
+    qt._m_import([str(csv_path), "imp"])
+    assert "Success" in capsys.readouterr().out
+    # импорт присоединяется к транзакции пользователя и откатывается вместе с ней
+    assert qt.rt.conn.in_transaction
+    qt._exec_sql("ROLLBACK;")
+    assert qt._list_tables() == []
+    assert qt.rt.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_exec_sql_batch_error_in_the_middle(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE u(id INTEGER UNIQUE);")
+    capsys.readouterr()
+    qt._exec_sql("INSERT INTO u VALUES (1); INSERT INTO u VALUES (1); INSERT INTO u VALUES (2);")
+    out = capsys.readouterr().out
+    # первая вставка выполнена, ошибка относится ко второй, третья не выполняется
+    assert out == "OK\nSQL error: UNIQUE constraint failed: u.id\n"
+    assert qt.rt.conn.execute("SELECT id FROM u").fetchall() == [(1,)]
+    assert not qt.rt.conn.in_transaction
+
+
+def test_tables_shows_temp_table(capsys):
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TEMP TABLE tt(a); INSERT INTO tt VALUES (42);")
+    capsys.readouterr()
+    qt._m_tables(["tt"])
+    assert "42" in capsys.readouterr().out
+
+
+def test_dump_uses_stdout_encoding(monkeypatch):
+    raw = io.BytesIO()
+    out = io.TextIOWrapper(raw, encoding="cp1251")
+    monkeypatch.setattr("sys.stdout", out)
+    qt = QT(":memory:")
+    qt.rt.conn.execute("CREATE TABLE t(s TEXT)")
+    qt.rt.conn.execute("INSERT INTO t VALUES ('привет')")
+    qt._m_dump([])
+    assert "привет".encode("cp1251") in raw.getvalue()
+
+
+def test_all_columns_survives_broken_view():
+    qt = QT(":memory:")
+    qt._exec_sql("CREATE TABLE a(x); CREATE TABLE b(y); CREATE VIEW v AS SELECT x FROM a;")
+    qt._exec_sql("DROP TABLE a;")
+    assert qt._all_columns() == ["y"]
+    assert _complete_all(qt, "y", "y") == ["y"]
+
+
+def test_setup_readline_disables_auto_history(monkeypatch):
+    rl = _FakeReadline()
+    monkeypatch.setitem(sys.modules, "readline", rl)
+    monkeypatch.setattr("sys.stdin", io.StringIO(""))
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: True)
+    qt = QT(":memory:")
+    qt._setup_readline()
+    # иначе input() сам добавляет строки в историю и append_history_file(N) пишет дубли
+    assert qt._readline is rl
+    assert rl.auto_history is False
+
+
+def test_run_saves_pending_history_on_interrupt(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(qt_mod, "HISTFILE", str(tmp_path / "hist"))
+    qt = QT(":memory:")
+    rl = qt._readline = _FakeReadline()
+    lines = iter(["SELECT 1;", ".tables"])
+
+    def read_line():
+        for line in lines:
+            return line
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(qt, "_read_line", read_line)
+    with pytest.raises(KeyboardInterrupt):
+        qt.run()
+    assert rl.history == ["SELECT 1;", ".tables"]
+    assert rl.writes == 1 and qt._unsaved == 0